@@ -11,12 +11,71 @@ import streamlit as st
 import streamlit.components.v1 as components
 import asyncio
 import json
+import weakref
 import logging
 import yfinance as yf
 
 from core.assistant import FinancialAssistant
 from tools.ingestion import DataIngestionTool
 
+PRICE_CACHE_TTL = 300  # seconds; repeated portfolio charts reuse prices instead of re-querying Yahoo
+
+class IncompletePriceData(Exception):
+    """Raised when Yahoo returns no close for some symbols, so the partial result is not cached."""
+    def __init__(self, closes, missing):
+        super().__init__(f"No price data for {', '.join(missing)}")
+        self.closes = closes
+        self.missing = missing
+
+@st.cache_data(ttl=PRICE_CACHE_TTL, show_spinner=False)
+def fetch_latest_closes(symbols):
+    """Fetches the latest closing price of each symbol in a single batched yfinance request."""
+    symbols = list(symbols)
+    data = yf.download(symbols, period="1d", group_by="ticker", threads=True, progress=False)
+    closes = {}
+    for symbol in symbols:
+        try:
+            close = data[symbol]["Close"].dropna()
+        except KeyError:
+            continue
+        if not close.empty:
+            closes[symbol] = float(close.iloc[-1])
+    # yf.download swallows per-ticker and network errors, so check for gaps explicitly
+    missing = [symbol for symbol in symbols if symbol not in closes]
+    if missing:
+        raise IncompletePriceData(closes, missing)
+    return closes
+
+def close_event_loop(loop):
+    """Shuts down pending async generators and the default executor, then closes the loop."""
+    if loop.is_closed():
+        return
+    try:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.run_until_complete(loop.shutdown_default_executor())
+    except RuntimeError:
+        # Finalizers can fire while another loop is running in this thread; just close
+        pass
+    finally:
+        loop.close()
+
+class SessionEventLoop:
+    """Owns a session's event loop and closes it when the session's state is dropped (or at exit)."""
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        weakref.finalize(self, close_event_loop, self.loop)
+
+def get_event_loop():
+    """Returns the session's persistent event loop so each chat turn doesn't build a new one."""
+    if "event_loop" not in st.session_state:
+        st.session_state.event_loop = SessionEventLoop()
+    return st.session_state.event_loop.loop
+
+@st.cache_resource
+def get_ingestion_tool():
+    """Returns the process-wide ingestion tool, so every session reads and writes the same document store."""
+    return DataIngestionTool()
+
 def display_portfolio_chart(holdings, values):
     """Generates a bar chart for portfolio holdings using Chart.js."""
     chart_config = {
@@ -48,6 +107,76 @@ def display_portfolio_chart(holdings, values):
         </script>
     """, height=300)
 
+@st.fragment
+def chat_panel(user_id):
+    """Renders the chat history and handles prompts; a prompt reruns only this fragment, not the sidebar."""
+    logger = logging.getLogger(__name__)
+
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"]):
+            st.write(message["content"])
+
+    if prompt := st.chat_input("Ask me about stocks, portfolio, SIPs, or document content..."):
+        logger.info(f"Processing user prompt: {prompt}")
+        st.session_state.messages.append({"role": "user", "content": prompt})
+        with st.chat_message("user"):
+            st.write(prompt)
+        with st.chat_message("assistant"):
+            with st.spinner("Processing your request with FAISS memory..."):
+                try:
+                    initial_state = {
+                        "messages": [prompt],
+                        "user_id": user_id,
+                        "context": {"enable_llm_fallback": st.session_state.enable_llm_fallback},
+                        "tool_results": {},
+                        "final_response": ""
+                    }
+                    response_state = get_event_loop().run_until_complete(
+                        st.session_state.assistant.workflow_graph.app.ainvoke(initial_state)
+                    )
+                    response = response_state.get("final_response", "No response generated.")
+
+                    logger.debug(f"Assistant response: {response}")
+                    st.write(response)
+
+                    if "portfolio" in response.lower() or "added" in response.lower():
+                        portfolio = st.session_state.assistant.db_manager.get_portfolio(user_id)
+                        if portfolio:
+                            logger.debug(f"Portfolio for chart: {portfolio.holdings}")
+                            values = []
+                            valid_holdings = {}
+                            try:
+                                closes = fetch_latest_closes(tuple(sorted(portfolio.holdings)))
+                            except IncompletePriceData as e:
+                                # Chart what did come back; missing symbols are warned about below
+                                closes = e.closes
+                            except Exception as e:
+                                closes = {}
+                                logger.error(f"Error fetching portfolio prices: {str(e)}")
+                                st.warning(f"Error fetching portfolio prices: {str(e)}")
+                            for symbol, quantity in portfolio.holdings.items():
+                                if symbol in closes:
+                                    value = closes[symbol] * quantity
+                                    values.append(value)
+                                    valid_holdings[symbol] = quantity
+                                    logger.debug(f"Chart data for {symbol}: value={value}")
+                                else:
+                                    values.append(0.0)
+                                    logger.warning(f"No data for {symbol}")
+                                    st.warning(f"No data for {symbol}")
+                            if any(v > 0 for v in values):
+                                display_portfolio_chart(valid_holdings, values)
+                            else:
+                                logger.error("No valid stock data available for chart")
+                                st.error("No valid stock data available for chart.")
+                    
+                    st.session_state.messages.append({"role": "assistant", "content": response})
+                except Exception as e:
+                    error_msg = f"I encountered an error: {str(e)}. Please try again."
+                    logger.error(f"Error processing prompt: {error_msg}", exc_info=True)
+                    st.error(error_msg)
+                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
+
 def main():
     """Main function to run the Streamlit application."""
     logging.basicConfig(
@@ -120,6 +249,9 @@ def main():
                 st.text(f"Index Type: {stats['index_type']}")
             except Exception as e:
                 st.error(f"Error loading stats: {str(e)}")
+            # Chat turns rerun only the chat fragment, so these stats refresh on full-app reruns
+            st.caption("Stats refresh when the sidebar reruns, not after each chat message.")
+            st.button("🔄 Refresh Stats", key="refresh_memory_stats")
         
         st.markdown("---")
         st.markdown("### 📄 Data Ingestion")
@@ -147,8 +279,10 @@ def main():
 
         st.subheader("Upload PDF")
         uploaded_file = st.file_uploader("Upload a PDF for RAG", type=["pdf"])
-        if uploaded_file:
+        # The uploader keeps its file across reruns; only ingest a newly uploaded one
+        if uploaded_file and st.session_state.get("ingested_file_id") != uploaded_file.file_id:
             message = st.session_state.ingestion_tool.ingest_from_pdf(uploaded_file)
+            st.session_state.ingested_file_id = uploaded_file.file_id
             st.success(message)
         
         st.subheader("Paste Text")
@@ -168,7 +302,7 @@ def main():
         try:
             logger.info("Initializing Financial Assistant with FAISS")
             if 'ingestion_tool' not in st.session_state:
-                st.session_state.ingestion_tool = DataIngestionTool()
+                st.session_state.ingestion_tool = get_ingestion_tool()
             with st.spinner("Initializing FAISS vector database..."):
                 st.session_state.assistant = FinancialAssistant(st.session_state.ingestion_tool)
             st.success("✅ Financial Assistant with FAISS ready!")
@@ -180,68 +314,7 @@ def main():
     if 'messages' not in st.session_state:
         st.session_state.messages = []
 
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.write(message["content"])
-
-    if prompt := st.chat_input("Ask me about stocks, portfolio, SIPs, or document content..."):
-        logger.info(f"Processing user prompt: {prompt}")
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        with st.chat_message("user"):
-            st.write(prompt)
-        with st.chat_message("assistant"):
-            with st.spinner("Processing your request with FAISS memory..."):
-                try:
-                    initial_state = {
-                        "messages": [prompt],
-                        "user_id": user_id,
-                        "context": {"enable_llm_fallback": st.session_state.enable_llm_fallback},
-                        "tool_results": {},
-                        "final_response": ""
-                    }
-                    response_state = asyncio.run(
-                        st.session_state.assistant.workflow_graph.app.ainvoke(initial_state)
-                    )
-                    response = response_state.get("final_response", "No response generated.")
-
-                    logger.debug(f"Assistant response: {response}")
-                    st.write(response)
-
-                    if "portfolio" in response.lower() or "added" in response.lower():
-                        portfolio = st.session_state.assistant.db_manager.get_portfolio(user_id)
-                        if portfolio:
-                            logger.debug(f"Portfolio for chart: {portfolio.holdings}")
-                            values = []
-                            valid_holdings = {}
-                            for symbol, quantity in portfolio.holdings.items():
-                                try:
-                                    stock = yf.Ticker(symbol)
-                                    hist = stock.history(period="1d")
-                                    if not hist.empty:
-                                        value = hist['Close'].iloc[-1] * quantity
-                                        values.append(value)
-                                        valid_holdings[symbol] = quantity
-                                        logger.debug(f"Chart data for {symbol}: value={value}")
-                                    else:
-                                        values.append(0.0)
-                                        logger.warning(f"No data for {symbol}")
-                                        st.warning(f"No data for {symbol}")
-                                except Exception as e:
-                                    values.append(0.0)
-                                    logger.error(f"Error fetching data for {symbol}: {str(e)}")
-                                    st.warning(f"Error fetching data for {symbol}: {str(e)}")
-                            if any(v > 0 for v in values):
-                                display_portfolio_chart(valid_holdings, values)
-                            else:
-                                logger.error("No valid stock data available for chart")
-                                st.error("No valid stock data available for chart.")
-                    
-                    st.session_state.messages.append({"role": "assistant", "content": response})
-                except Exception as e:
-                    error_msg = f"I encountered an error: {str(e)}. Please try again."
-                    logger.error(f"Error processing prompt: {error_msg}", exc_info=True)
-                    st.error(error_msg)
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
+    chat_panel(user_id)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
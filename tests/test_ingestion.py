@@ -0,0 +1,210 @@
+import io
+import sys
+import types
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+pytest.importorskip("langchain_text_splitters")
+
+from tools import ingestion
+
+
+def _fake_pdfium(pages):
+    """Minimal stand-in for pypdfium2 that yields the given page texts."""
+    class FakePage:
+        def __init__(self, text):
+            self.text = text
+
+        def get_textpage(self):
+            return types.SimpleNamespace(get_text_range=lambda: self.text)
+
+    class FakePdfDocument:
+        def __init__(self, path):
+            pass
+
+        def __iter__(self):
+            return iter(FakePage(text) for text in pages)
+
+        def close(self):
+            pass
+
+    return types.SimpleNamespace(PdfDocument=FakePdfDocument)
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """Shrinks chunk and batch sizes so a handful of pages crosses several batch boundaries."""
+    monkeypatch.setattr(ingestion, "CHUNK_SIZE", 40)
+    monkeypatch.setattr(ingestion, "CHUNK_OVERLAP", 0)
+    monkeypatch.setattr(ingestion, "PIPELINE_BATCH_CHUNKS", 2)
+
+
+def test_extract_pdf_chunks_keeps_page_boundaries(tmp_path, monkeypatch, small_chunks):
+    pages = [f"page{i} starts here and ends at word{i}." for i in range(12)]
+    monkeypatch.setitem(sys.modules, "pypdfium2", _fake_pdfium(pages))
+    tool = ingestion.DataIngestionTool(persist_dir=str(tmp_path))
+
+    batches = []
+    tool._extract_pdf_chunks(io.BytesIO(b"%PDF-1.4"), batches.append)
+
+    assert len(batches) > 2
+    chunk_words = {word for batch in batches for chunk in batch for word in chunk.split()}
+    page_words = {word for page in pages for word in page.split()}
+    assert chunk_words == page_words
+
+
+def _fake_encode(texts):
+    return np.ones((len(texts), 4), dtype=np.float32)
+
+
+def test_pipelined_ingest_adds_nothing_when_producer_fails(tmp_path, monkeypatch):
+    tool = ingestion.DataIngestionTool(persist_dir=str(tmp_path))
+    monkeypatch.setattr(tool, "_encode", _fake_encode)
+
+    def produce(emit):
+        emit(["first chunk", "second chunk"])
+        raise ValueError("bad page")
+
+    with pytest.raises(ValueError):
+        tool._add_chunks_pipelined(produce, ["pdf:abc"])
+
+    assert tool.chunks == []
+    assert tool.pending == []
+    assert "pdf:abc" not in tool.sources
+
+
+def test_pipelined_ingest_keeps_completed_sources_when_a_later_one_fails(tmp_path, monkeypatch):
+    tool = ingestion.DataIngestionTool(persist_dir=str(tmp_path))
+    monkeypatch.setattr(tool, "_encode", _fake_encode)
+
+    def produce(emit):
+        emit(["first file"], ["gdrive:1"])
+        emit(["half of second file"])
+        raise ValueError("export failed")
+
+    with pytest.raises(ValueError):
+        tool._add_chunks_pipelined(produce)
+
+    assert tool.chunks == ["first file"]
+    assert "gdrive:1" in tool.sources
+    reloaded = ingestion.DataIngestionTool(persist_dir=str(tmp_path))
+    assert reloaded.chunks == ["first file"]
+    assert "gdrive:1" in reloaded.sources
+
+
+def test_website_without_text_is_not_recorded(tmp_path, monkeypatch):
+    pytest.importorskip("bs4")
+    tool = ingestion.DataIngestionTool(persist_dir=str(tmp_path))
+    monkeypatch.setattr(tool, "_encode", _fake_encode)
+
+    async def fetch_html(url):
+        return "<html><body><div>Checking your browser...</div></body></html>"
+
+    monkeypatch.setattr(tool, "_fetch_html", fetch_html)
+
+    assert tool.ingest_from_website("https://example.com").startswith("❌")
+    assert tool.sources == set()
+
+
+def test_new_drive_revision_replaces_old_chunks(tmp_path, monkeypatch):
+    tool = ingestion.DataIngestionTool(persist_dir=str(tmp_path))
+    monkeypatch.setattr(tool, "_encode", _fake_encode)
+
+    for revision in ("old", "new"):
+        key = f"gdrive:doc1:{revision}"
+        tool._add_chunks_pipelined(
+            lambda emit: emit([f"{revision} draft"], [key]),
+            documents={key: "gdrive:doc1"}
+        )
+
+    assert tool.get_top_chunks("draft", k=5) == "new draft"
+    reloaded = ingestion.DataIngestionTool(persist_dir=str(tmp_path))
+    monkeypatch.setattr(reloaded, "_encode", _fake_encode)
+    assert reloaded.get_top_chunks("draft", k=5) == "new draft"
+
+
+def test_store_recovers_from_corrupt_index(tmp_path, monkeypatch):
+    (tmp_path / "doc_index.bin").write_bytes(b"not a faiss index")
+    (tmp_path / "doc_chunks.pkl").write_bytes(b"stale")
+    tool = ingestion.DataIngestionTool(persist_dir=str(tmp_path))
+    monkeypatch.setattr(tool, "_encode", _fake_encode)
+    assert tool.chunks == []
+
+    tool._add_chunks(["fresh chunk"], ["text:fresh"])
+
+    assert not (tmp_path / "doc_index.bin").exists()
+    reloaded = ingestion.DataIngestionTool(persist_dir=str(tmp_path))
+    assert reloaded.chunks == ["fresh chunk"]
+    assert "text:fresh" in reloaded.sources
+
+
+def _encode_points(texts):
+    """Reads each text as comma-separated coordinates and returns them as unit vectors."""
+    points = np.array([[float(v) for v in text.split(",")] for text in texts], dtype=np.float32)
+    return points / np.linalg.norm(points, axis=1, keepdims=True)
+
+
+def test_vectors_stay_pending_until_train_size(tmp_path, monkeypatch):
+    tool = ingestion.DataIngestionTool(persist_dir=str(tmp_path), train_size=3)
+    monkeypatch.setattr(tool, "_encode", _encode_points)
+
+    tool._add_chunks(["1,0", "0,1"])
+    assert tool.index is None
+    assert len(tool._pending_matrix()) == 2
+
+    tool._add_chunks(["-1,0"])
+    assert tool.index is not None
+    assert tool.index.ntotal == 3
+    assert tool.pending == []
+
+    tool._add_chunks(["0,-1"])
+    assert tool.index.ntotal == 4
+    assert tool.chunks == ["1,0", "0,1", "-1,0", "0,-1"]
+
+
+def test_store_reloads_before_and_after_training(tmp_path, monkeypatch):
+    tool = ingestion.DataIngestionTool(persist_dir=str(tmp_path), train_size=3)
+    monkeypatch.setattr(tool, "_encode", _encode_points)
+
+    tool._add_chunks(["1,0", "0,1"])
+    assert (tmp_path / "doc_embeddings.npy").exists()
+    assert not (tmp_path / "doc_index.bin").exists()
+    reloaded = ingestion.DataIngestionTool(persist_dir=str(tmp_path), train_size=3)
+    assert reloaded.index is None
+    assert reloaded.chunks == ["1,0", "0,1"]
+    np.testing.assert_allclose(reloaded._pending_matrix(), tool._pending_matrix())
+
+    monkeypatch.setattr(reloaded, "_encode", _encode_points)
+    reloaded._add_chunks(["-1,0"])
+    assert (tmp_path / "doc_index.bin").exists()
+    assert not (tmp_path / "doc_embeddings.npy").exists()
+    trained = ingestion.DataIngestionTool(persist_dir=str(tmp_path), train_size=3)
+    monkeypatch.setattr(trained, "_encode", _encode_points)
+    assert trained.index.ntotal == 3
+    assert trained.get_top_chunks("-1,0.1", k=1) == "-1,0"
+
+
+def test_exact_search_returns_top_k_in_order(tmp_path, monkeypatch):
+    tool = ingestion.DataIngestionTool(persist_dir=str(tmp_path))
+    monkeypatch.setattr(tool, "_encode", _encode_points)
+    tool._add_chunks(["0,1", "-1,0", "1,0", "0.8,0.6"])
+    assert tool.index is None
+
+    assert tool.get_top_chunks("1,0", k=2) == "1,0\n\n0.8,0.6"
+    assert tool.get_top_chunks("1,0", k=4) == "1,0\n\n0.8,0.6\n\n0,1\n\n-1,0"
+    assert tool.get_top_chunks("1,0", k=10) == "1,0\n\n0.8,0.6\n\n0,1\n\n-1,0"
+
+
+def test_add_chunks_skips_sources_already_indexed(tmp_path, monkeypatch):
+    tool = ingestion.DataIngestionTool(persist_dir=str(tmp_path))
+    monkeypatch.setattr(tool, "_encode", _encode_points)
+
+    assert tool._add_chunks(["1,0", "0,1"], ["text:a"]) == 2
+    assert tool._add_chunks(["1,0", "0,1"], ["text:a"]) == 0
+    assert tool.chunks == ["1,0", "0,1"]
+    assert len(tool._pending_matrix()) == 2
+
+    assert tool._add_chunks(["-1,0"], ["text:a", "text:b"]) == 1
+    assert tool.sources == {"text:a", "text:b"}
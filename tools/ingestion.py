@@ -1,42 +1,147 @@
 # tools/ingestion.py
 import os
 import logging
-from PyPDF2 import PdfReader
-from sentence_transformers import SentenceTransformer
+import functools
+import hashlib
+import io
+import shutil
+import tempfile
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-import requests
-from bs4 import BeautifulSoup
-from youtube_transcript_api import YouTubeTranscriptApi
-from openai import OpenAI
+import faiss
 import asyncio
-import io
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseDownload
-from google.auth.transport.requests import Request as GoogleRequest
+import pickle
+import queue
+import threading
+from pathlib import Path
+
+# Heavy client libraries (PDFium, HTML, YouTube, Google, sentence-transformers) are
+# imported inside the methods that use them to keep app start-up fast.
 
 logger = logging.getLogger(__name__)
 
 # Constants
-CHUNK_SIZE = 300
+CHUNK_SIZE = 1500  # characters
+CHUNK_OVERLAP = 150
+CHUNK_SEPARATORS = ["\n\n", "\n", ". ", " ", ""]
 MODEL_NAME = "all-MiniLM-L6-v2"
+ONNX_MODEL_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+ENCODE_BATCH_SIZE = 64
+PIPELINE_BATCH_CHUNKS = 32  # chunks handed from the extraction thread to the encoder at a time
+PIPELINE_QUEUE_SIZE = 4
+DRIVE_EXPORT_URL = "https://www.googleapis.com/drive/v3/files/{file_id}/export"
+EXACT_SEARCH_MAX_VECTORS = 1_000  # below this, brute-force numpy search is faster than an ANN index
+IVFPQ_TRAIN_SIZE = 10_000  # vectors needed to train IVF256 centroids and PQ codebooks
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Load sentence embedding model
-model = SentenceTransformer(MODEL_NAME)
+@functools.cache
+def _model():
+    """Loads the embedding model on first use, preferring its int8-quantized ONNX export."""
+    from sentence_transformers import SentenceTransformer
+    try:
+        return SentenceTransformer(MODEL_NAME, backend="onnx", model_kwargs={"file_name": ONNX_MODEL_FILE})
+    except Exception as e:
+        logger.warning(f"ONNX embedding backend unavailable, using PyTorch model: {e}")
+        return SentenceTransformer(MODEL_NAME)
 
-# Global state for ingested data
-doc_chunks, doc_embeddings = [], []
+def build_hnsw_index(dim):
+    """HNSW graph over 8-bit scalar-quantized vectors for sub-linear top-k search."""
+    index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+def build_ivfpq_index(dim):
+    """IVF-PQ index for very large corpora; needs IVFPQ_TRAIN_SIZE vectors to train its codebooks."""
+    index = faiss.index_factory(dim, "IVF256,PQ32x8", faiss.METRIC_INNER_PRODUCT)
+    faiss.extract_index_ivf(index).nprobe = IVF_NPROBE
+    return index
 
 class DataIngestionTool:
-    def __init__(self):
+    def __init__(self, index_builder=build_hnsw_index, persist_dir: str = "./ingestion_storage", train_size: int = None):
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
         self.name = "data_ingestion"
         self.description = "Ingest data from various sources (PDF, websites, YouTube, text) for RAG."
-        
+        self.index_builder = index_builder
+        # The tool is shared by every app session; guards the index, chunks, sources and store files
+        self.lock = threading.RLock()
+        # Vectors are searched exactly until there are enough of them to train the index once
+        if train_size is None:
+            train_size = IVFPQ_TRAIN_SIZE if index_builder is build_ivfpq_index else EXACT_SEARCH_MAX_VECTORS
+        self.train_size = train_size
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            separators=CHUNK_SEPARATORS
+        )
+        self.persist_dir = Path(persist_dir)
+        self.persist_dir.mkdir(exist_ok=True)
+        self.index_path = self.persist_dir / "doc_index.bin"
+        self.embeddings_path = self.persist_dir / "doc_embeddings.npy"
+        self.chunks_path = self.persist_dir / "doc_chunks.pkl"
+        self._load_store()
+
+    def _load_store(self):
+        """Restores previously ingested chunks and their vectors from disk."""
+        self._reset_store()
+        try:
+            if self.chunks_path.exists():
+                if self.index_path.exists():
+                    self.index = faiss.read_index(str(self.index_path))
+                elif self.embeddings_path.exists():
+                    self.pending = [np.load(self.embeddings_path)]
+                with open(self.chunks_path, 'rb') as f:
+                    store = pickle.load(f)
+                self.chunks, self.sources = store["chunks"], store["sources"]
+                self.documents, self.stale = store.get("documents", {}), store.get("stale", set())
+                vectors = self.index.ntotal if self.index is not None else sum(len(batch) for batch in self.pending)
+                if vectors != len(self.chunks):
+                    raise ValueError(f"{vectors} stored vectors for {len(self.chunks)} chunks")
+                logger.info(f"Loaded {len(self.chunks)} ingested chunks from {self.persist_dir}")
+        except Exception as e:
+            logger.warning(f"Error loading ingestion store, starting empty: {e}")
+            self._reset_store()
+
+    def _reset_store(self):
+        self.index, self.pending, self.chunks, self.sources = None, [], [], set()
+        # Chunk positions of each document's latest revision, and positions superseded by a newer one
+        self.documents, self.stale = {}, set()
+
+    def _save_store(self):
+        def save_chunks(path):
+            with open(path, 'wb') as f:
+                pickle.dump({"chunks": self.chunks, "sources": self.sources, "documents": self.documents, "stale": self.stale}, f)
+
+        try:
+            # Remove whichever vector file does not match the current state, so a store that
+            # failed to load is fully replaced rather than loaded again on the next start
+            if self.index is not None:
+                self._write_atomic(self.index_path, lambda path: faiss.write_index(self.index, path))
+                self.embeddings_path.unlink(missing_ok=True)
+            else:
+                self.index_path.unlink(missing_ok=True)
+                if self.pending:
+                    self._write_atomic(self.embeddings_path, lambda path: np.save(path, self._pending_matrix()))
+                else:
+                    self.embeddings_path.unlink(missing_ok=True)
+            self._write_atomic(self.chunks_path, save_chunks)
+        except Exception as e:
+            logger.error(f"Error saving ingestion store: {e}")
+
+    def _write_atomic(self, path, write):
+        """Writes a store file under a temporary name, then swaps it into place."""
+        # Keep the suffix so np.save does not append another ".npy"
+        tmp_path = path.with_name(f".tmp-{path.name}")
+        write(str(tmp_path))
+        os.replace(tmp_path, path)
+
     def _get_google_credentials(self):
+        from google.oauth2.credentials import Credentials
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from google.auth.transport.requests import Request as GoogleRequest
         creds = None
         if os.path.exists('token.json'):
             creds = Credentials.from_authorized_user_file('token.json', ['https://www.googleapis.com/auth/drive.readonly'])
@@ -59,30 +164,215 @@ class DataIngestionTool:
                 token.write(creds.to_json())
         return creds
 
-    def split_text(self, text, size=CHUNK_SIZE):
-        """Splits text into fixed-size word chunks."""
-        words = text.split()
-        return [" ".join(words[i:i + size]) for i in range(0, len(words), size)]
+    def split_text(self, text):
+        """Splits text into overlapping chunks along paragraph and sentence boundaries."""
+        return self.text_splitter.split_text(text)
+
+    def _encode(self, texts):
+        """Encodes texts into L2-normalized float32 embeddings in large batches."""
+        return _model().encode(
+            texts,
+            batch_size=ENCODE_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        ).astype(np.float32)
+
+    def _source_key(self, kind, content):
+        """Content-addressed key used to skip sources that are already indexed."""
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        return f"{kind}:{hashlib.blake2b(content, digest_size=16).hexdigest()}"
+
+    def _pending_matrix(self):
+        """Concatenates the not-yet-indexed embedding batches into one matrix (once per change)."""
+        if len(self.pending) > 1:
+            self.pending = [np.concatenate(self.pending)]
+        return self.pending[0]
+
+    def _append_embeddings(self, embeddings, new_chunks):
+        """Appends embedded chunks to the index, training it once enough vectors are pending."""
+        if self.index is not None:
+            self.index.add(embeddings)
+        else:
+            self.pending.append(embeddings)
+            if sum(len(batch) for batch in self.pending) >= self.train_size:
+                pending = self._pending_matrix()
+                self.index = self.index_builder(pending.shape[1])
+                self.index.train(pending)
+                self.index.add(pending)
+                self.pending = []
+        self.chunks.extend(new_chunks)
+
+    def _replace_documents(self, keys, documents, start):
+        """Points each document at the chunks from start onwards, marking its previous revision's chunks stale."""
+        for key in keys:
+            doc_id = documents.get(key)
+            if doc_id is None:
+                continue
+            if doc_id in self.documents:
+                self.stale.update(range(*self.documents[doc_id]))
+            self.documents[doc_id] = (start, len(self.chunks))
+
+    def _add_chunks(self, new_chunks, source_keys=()):
+        """Embeds only the new chunks and appends them to the persistent index."""
+        embeddings = self._encode(new_chunks) if new_chunks else None
+        with self.lock:
+            # Another session may have ingested the same source meanwhile
+            if source_keys and set(source_keys) <= self.sources:
+                return 0
+            if new_chunks:
+                self._append_embeddings(embeddings, new_chunks)
+            self.sources.update(source_keys)
+            self._save_store()
+        return len(new_chunks)
+
+    def _add_chunks_pipelined(self, produce, source_keys=(), documents=None):
+        """Runs produce(emit) in a background thread, embedding each emitted batch of chunks as it arrives.
+
+        documents optionally maps a source key to the id of the document it is a revision of;
+        committing that key replaces the document's earlier chunks in search results.
+        """
+        documents = documents or {}
+        batches = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        done, cancelled, errors = object(), threading.Event(), []
+
+        def emit(batch, batch_source_keys=()):
+            if cancelled.is_set():
+                raise RuntimeError("Ingestion cancelled")
+            if batch or batch_source_keys:
+                batches.put((batch, tuple(batch_source_keys)))
+
+        def producer():
+            try:
+                produce(emit)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                batches.put(done)
+
+        new_embeddings, new_chunks = [], []
+        added, committed = 0, False
+
+        def commit(keys):
+            nonlocal new_embeddings, new_chunks, added, committed
+            with self.lock:
+                if not (keys and set(keys) <= self.sources):
+                    start = len(self.chunks)
+                    if new_chunks:
+                        self._append_embeddings(np.concatenate(new_embeddings), new_chunks)
+                        added += len(new_chunks)
+                    self._replace_documents(keys, documents, start)
+                self.sources.update(keys)
+            new_embeddings, new_chunks, committed = [], [], True
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while (item := batches.get()) is not done:
+                batch, batch_source_keys = item
+                if batch:
+                    new_embeddings.append(self._encode(batch))
+                    new_chunks.extend(batch)
+                # A batch emitted with source keys completes those sources, so it can be indexed right away
+                if batch_source_keys:
+                    commit(batch_source_keys)
+            if errors:
+                raise errors[0]
+            # Index the rest only once the whole source has been embedded, so a failure leaves no partial chunks behind
+            commit(source_keys)
+        finally:
+            # Unblock the producer if encoding failed part-way through
+            cancelled.set()
+            while thread.is_alive():
+                try:
+                    batches.get_nowait()
+                except queue.Empty:
+                    thread.join(0.05)
+            # Persist completed sources even if a later one failed
+            if committed:
+                with self.lock:
+                    self._save_store()
+        return added
 
     def ingest_from_pdf(self, file_obj):
         """Processes the uploaded PDF and caches its embeddings."""
-        global doc_chunks, doc_embeddings
         try:
-            text = self.extract_pdf_text(file_obj)
-            doc_chunks = self.split_text(text)
-            doc_embeddings = model.encode(doc_chunks, convert_to_numpy=True)
-            return f"✅ Processed {len(doc_chunks)} chunks from PDF."
+            key = self._source_key("pdf", file_obj.getvalue())
+            if key in self.sources:
+                return "✅ This PDF has already been ingested."
+            added = self._add_chunks_pipelined(lambda emit: self._extract_pdf_chunks(file_obj, emit), [key])
+            return f"✅ Processed {added} chunks from PDF."
         except Exception as e:
             return f"❌ Failed to process PDF: {e}"
 
-    def extract_pdf_text(self, file_obj):
-        """Extracts and joins text from all pages of a PDF."""
-        reader = PdfReader(file_obj)
-        return "\n".join([page.extract_text() or "" for page in reader.pages])
+    def _extract_pdf_chunks(self, file_obj, emit):
+        """Extracts a PDF page by page, emitting batches of chunks as soon as enough text is buffered."""
+        import pypdfium2 as pdfium
+        # Spool the upload to disk so PDFium reads pages from the file on demand
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            file_obj.seek(0)
+            shutil.copyfileobj(file_obj, tmp)
+        try:
+            pdf = pdfium.PdfDocument(tmp.name)
+            try:
+                buffer, buffered = io.StringIO(), 0
+                for page in pdf:
+                    text = page.get_textpage().get_text_range()
+                    buffer.write(text)
+                    buffer.write("\n")
+                    buffered += len(text) + 1
+                    if buffered >= PIPELINE_BATCH_CHUNKS * CHUNK_SIZE:
+                        chunks = self.split_text(buffer.getvalue())
+                        # The last chunk may be cut off mid-page; carry it over into the next batch.
+                        # The splitter strips whitespace, so restore the page separator after it.
+                        carry = chunks.pop() + "\n" if chunks else ""
+                        buffer, buffered = io.StringIO(), len(carry)
+                        buffer.write(carry)
+                        emit(chunks)
+                emit(self.split_text(buffer.getvalue()))
+            finally:
+                pdf.close()
+        finally:
+            os.unlink(tmp.name)
+
+    async def _download_drive_file(self, session, creds, file_id, export_mime):
+        """Exports a single Google Drive file as text."""
+        async with session.get(
+            DRIVE_EXPORT_URL.format(file_id=file_id),
+            params={"mimeType": export_mime},
+            headers={"Authorization": f"Bearer {creds.token}"}
+        ) as response:
+            response.raise_for_status()
+            return (await response.read()).decode('utf-8')
+
+    async def _download_drive_files(self, creds, items, export_mime, keys, emit):
+        """Downloads all Drive files concurrently, emitting each file's chunks and source key as soon as it arrives."""
+        import aiohttp
+
+        async def download(session, item):
+            return item, await self._download_drive_file(session, creds, item['id'], export_mime)
+
+        async with aiohttp.ClientSession() as session:
+            for completed in asyncio.as_completed([download(session, item) for item in items]):
+                item, text = await completed
+                # Split and hand off outside the event loop so the remaining downloads keep flowing
+                await asyncio.to_thread(lambda: emit(self.split_text(text), [keys[item['id']]]))
+
+    async def _fetch_html(self, url):
+        """Fetches a web page's HTML."""
+        import aiohttp
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                # Pages without a charset header are not always UTF-8
+                return await response.text(errors="replace")
 
     def ingest_from_gdrive(self, file_type):
         """Ingests content from Google Drive (Docs/Slides)."""
-        global doc_chunks, doc_embeddings
+        import aiohttp
+        from googleapiclient.discovery import build
+        from googleapiclient.errors import HttpError
         try:
             creds = self._get_google_credentials()
             drive_service = build('drive', 'v3', credentials=creds)
@@ -96,82 +386,95 @@ class DataIngestionTool:
             else:
                 return "Unsupported Google file type."
             
-            results = drive_service.files().list(q=f"mimeType='{mime_type}'", pageSize=10, fields="files(id, name)").execute()
+            results = drive_service.files().list(q=f"mimeType='{mime_type}'", pageSize=10, fields="files(id, name, modifiedTime)").execute()
             items = results.get('files', [])
             
             if not items:
                 return f"No Google {file_type.capitalize()} found in your Drive."
-                
-            full_text = ""
-            for item in items:
-                file_id = item['id']
-                file_name = item['name']
-                
-                request = drive_service.files().export_media(fileId=file_id, mimeType=export_mime)
-                fh = io.BytesIO()
-                downloader = MediaIoBaseDownload(fh, request)
-                done = False
-                while done is False:
-                    status, done = downloader.next_chunk()
-                
-                fh.seek(0)
-                full_text += fh.read().decode('utf-8') + "\n\n"
-            
-            doc_chunks = self.split_text(full_text)
-            doc_embeddings = model.encode(doc_chunks, convert_to_numpy=True)
+
+            # Only download files that are new or have changed since they were last ingested;
+            # a changed file's new chunks replace its old ones in search results
+            keys = {item['id']: self._source_key("gdrive", f"{item['id']}:{item.get('modifiedTime')}") for item in items}
+            items = [item for item in items if keys[item['id']] not in self.sources]
+            if not items:
+                return f"✅ All Google {file_type.capitalize()} have already been ingested."
+
+            self._add_chunks_pipelined(
+                lambda emit: asyncio.run(self._download_drive_files(creds, items, export_mime, keys, emit)),
+                documents={keys[item['id']]: f"gdrive:{item['id']}" for item in items}
+            )
             return f"✅ Successfully ingested {len(items)} Google {file_type.capitalize()}."
 
-        except HttpError as e:
+        except (HttpError, aiohttp.ClientResponseError) as e:
             return f"❌ Google API error: {e}"
         except Exception as e:
             return f"❌ Failed to ingest from Google Drive: {str(e)}"
 
     def ingest_from_website(self, url):
         """Ingests content from a website."""
-        global doc_chunks, doc_embeddings
         try:
-            response = requests.get(url)
-            soup = BeautifulSoup(response.text, 'html.parser')
+            key = self._source_key("website", url)
+            if key in self.sources:
+                return f"✅ Website {url} has already been ingested."
+            html = asyncio.run(self._fetch_html(url))
+            from bs4 import BeautifulSoup
+            soup = BeautifulSoup(html, 'html.parser')
             text = ' '.join(p.get_text() for p in soup.find_all('p'))
-            doc_chunks = self.split_text(text)
-            doc_embeddings = model.encode(doc_chunks, convert_to_numpy=True)
-            return f"✅ Successfully ingested website from {url}. {len(doc_chunks)} chunks created."
+            chunks = self.split_text(text)
+            # Leave the URL unrecorded so a later retry fetches the page again
+            if not chunks:
+                return f"❌ No text found on {url}."
+            added = self._add_chunks(chunks, [key])
+            return f"✅ Successfully ingested website from {url}. {added} chunks created."
         except Exception as e:
             return f"❌ Error ingesting website from {url}: {str(e)}"
 
     def ingest_from_youtube(self, url):
         """Ingests a YouTube video transcript."""
-        global doc_chunks, doc_embeddings
         try:
             video_id = url.split("v=")[-1]
+            key = self._source_key("youtube", video_id)
+            if key in self.sources:
+                return "✅ This YouTube transcript has already been ingested."
+            from youtube_transcript_api import YouTubeTranscriptApi
             transcript_list = YouTubeTranscriptApi.get_transcript(video_id)
             text = " ".join([d['text'] for d in transcript_list])
-            doc_chunks = self.split_text(text)
-            doc_embeddings = model.encode(doc_chunks, convert_to_numpy=True)
-            return f"✅ Successfully ingested YouTube transcript. {len(doc_chunks)} chunks created."
+            added = self._add_chunks(self.split_text(text), [key])
+            return f"✅ Successfully ingested YouTube transcript. {added} chunks created."
         except Exception as e:
             return f"❌ Error ingesting YouTube transcript: {str(e)}"
     
     def ingest_from_text(self, text):
         """Ingests plain text."""
-        global doc_chunks, doc_embeddings
         try:
-            doc_chunks = self.split_text(text)
-            doc_embeddings = model.encode(doc_chunks, convert_to_numpy=True)
-            return f"✅ Successfully ingested pasted text. {len(doc_chunks)} chunks created."
+            key = self._source_key("text", text)
+            if key in self.sources:
+                return "✅ This text has already been ingested."
+            added = self._add_chunks(self.split_text(text), [key])
+            return f"✅ Successfully ingested pasted text. {added} chunks created."
         except Exception as e:
             return f"❌ Error ingesting text: {str(e)}"
     
     def get_top_chunks(self, query, k=3):
         """Finds top-k relevant chunks using cosine similarity."""
-        global doc_chunks, doc_embeddings
-        if not doc_chunks or not isinstance(doc_embeddings, np.ndarray) or doc_embeddings.size == 0:
+        if not self.chunks:
             return None
         try:
-            query_emb = model.encode([query], convert_to_numpy=True)
-            sims = cosine_similarity(query_emb, doc_embeddings)[0]
-            indices = np.argsort(sims)[::-1][:k]
-            return "\n\n".join([doc_chunks[i] for i in indices if i < len(doc_chunks)])
+            query_emb = self._encode([query])
+            with self.lock:
+                # Over-fetch so that skipping superseded chunks still leaves k results
+                fetch = k + len(self.stale)
+                if self.index is not None:
+                    _, indices = self.index.search(query_emb, min(fetch, self.index.ntotal))
+                    indices = indices[0]
+                else:
+                    # Embeddings are unit-length, so the inner product is the cosine similarity
+                    sims = (self._pending_matrix() @ query_emb.T).ravel()
+                    fetch = min(fetch, len(sims))
+                    indices = np.argpartition(-sims, fetch - 1)[:fetch]
+                    indices = indices[np.argsort(-sims[indices])]
+                indices = [i for i in indices if 0 <= i < len(self.chunks) and i not in self.stale][:k]
+                return "\n\n".join([self.chunks[i] for i in indices])
         except Exception as e:
             logger.error(f"Error in get_top_chunks: {e}")
             return None
\ No newline at end of file